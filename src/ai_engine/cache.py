@@ -0,0 +1,43 @@
+"""
+Redis-backed cache for AI analysis responses.
+"""
+import hashlib
+import json
+from typing import Dict, Optional
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+
+class ResponseCache:
+    """Exact-match cache for AI responses, keyed by a hash of the prompt inputs."""
+
+    def __init__(self, url: str = "redis://localhost:6379", ttl: int = 24 * 60 * 60,
+                 prefix: str = "ai:"):
+        self.redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """Build a stable cache key from the given parts."""
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """Return the cached value, or None on a miss or if Redis is unavailable."""
+        try:
+            raw = await self.redis.get(self.prefix + key)
+        except RedisError:
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Dict):
+        """Store a value with the configured TTL; failures are ignored."""
+        try:
+            await self.redis.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        except RedisError:
+            pass
+
+    async def close(self):
+        """Close the underlying connection pool."""
+        await self.redis.close()
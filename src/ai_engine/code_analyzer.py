@@ -1,12 +1,73 @@
 """
 AI-powered code complexity analyzer using GPT-4.
 """
+import aiofiles
+import asyncio
+import hashlib
+import httpx
+import json
 import openai
-from typing import Dict, List, Optional
+from collections import Counter, OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from dataclasses import dataclass
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 import ast
 import re
 
+from src.ai_engine.cache import ResponseCache
+
+# Structured output schema for the AI response. Strict mode doesn't support
+# numeric bounds or maxItems, so those limits are also enforced in _parse_response.
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "number", "description": "Complexity rating from 0 to 10"},
+        "suggestions": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "At most 5 suggestions"
+        },
+    },
+    "required": ["score", "suggestions"],
+    "additionalProperties": False,
+}
+
+# Matches a completed "score" field in a partially streamed response
+PARTIAL_SCORE_RE = re.compile(r'"score"\s*:\s*(-?\d+(?:\.\d+)?)\s*[,}]')
+
+# Terminal states of an OpenAI batch job
+BATCH_DONE_STATES = ('completed', 'failed', 'expired', 'cancelled')
+
+# Errors worth retrying, matching what the SDK's own retry logic covers:
+# connection errors and timeouts, 409, 429 and 5xx responses (408 is checked
+# separately in _is_retryable since the SDK has no dedicated class for it)
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.ConflictError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+def _is_retryable(error: BaseException) -> bool:
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code == 408
+
+
+# Retry policy for OpenAI requests (the client's own retries are disabled)
+_retry_transient = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(min=1, max=30),
+    retry=retry_if_exception(_is_retryable),
+    reraise=True
+)
+
+
+def _clamp_score(value) -> float:
+    """Coerce an AI complexity score into the 0-10 range."""
+    return min(10.0, max(0.0, float(value)))
+
 
 @dataclass
 class ComplexityScore:
@@ -16,25 +77,271 @@ class ComplexityScore:
     suitable_for_beginner: bool
 
 
+@dataclass
+class BatchSubmission:
+    batch_id: str
+    # Cache key of the snippet submitted for each file, used to detect files
+    # that changed before the batch finished
+    snippet_keys: Dict[str, str]
+
+
 class CodeAnalyzer:
     """Analyzes code complexity using AI and static analysis."""
 
-    def __init__(self, model: str = "gpt-4", api_key: Optional[str] = None):
+    # Static instructions go first and the code last, so the shared prefix
+    # is long enough (>1024 tokens) for the provider's automatic prompt caching.
+    SYSTEM_PROMPT = """You are a code complexity expert helping open source maintainers decide \
+which parts of a codebase are suitable for first-time contributors. Every user message \
+contains a single Python source file (possibly truncated). Assess how hard it would be for \
+a newcomer to understand and safely modify that code.
+
+Rate complexity on a 0-10 scale using this rubric:
+
+0-2 (Trivial)
+- Short, flat modules: constants, simple data containers, thin wrappers.
+- Functions are a few lines long with at most one branch.
+- No concurrency, metaprogramming or non-obvious control flow.
+- Names are descriptive and the intent is clear without outside context.
+
+3-4 (Beginner friendly)
+- Straightforward functions and small classes with clear responsibilities.
+- Some branching and loops, but nesting rarely goes beyond two levels.
+- Uses only the standard library or very common, well-documented packages.
+- A newcomer could make a meaningful change after reading the file once.
+
+5-6 (Intermediate)
+- Several interacting classes, moderate nesting, or non-trivial algorithms.
+- Error handling paths that must be kept consistent across functions.
+- Relies on framework conventions (web frameworks, ORMs, async I/O) that
+  a newcomer would need to learn first.
+- Changes require understanding how this file is used elsewhere.
+
+7-8 (Advanced)
+- Dense logic with deep nesting, long functions or many special cases.
+- Concurrency, caching, state machines, or performance-sensitive code.
+- Implicit invariants that are easy to break and hard to test.
+- Heavy use of decorators, descriptors, dynamic attribute access or other
+  metaprogramming.
+
+9-10 (Expert)
+- Core infrastructure whose behaviour affects the whole project.
+- Low-level numerical, parsing, compiler or protocol code.
+- Subtle correctness or security requirements; mistakes are costly.
+- Requires significant domain knowledge beyond the code itself.
+
+When scoring, weigh these factors:
+1. Control flow: branching, nesting depth, early returns, exception handling.
+2. Size: length of functions and classes relative to what they do.
+3. Abstractions: inheritance depth, indirection, generics and protocols.
+4. Dependencies: external libraries, frameworks and implicit global state.
+5. Readability: naming, comments, docstrings and consistency of style.
+6. Risk: how likely a small change is to cause a regression elsewhere.
+
+Calibration examples:
+- A settings module that only assigns constants and reads a few environment
+  variables: 1/10.
+- A command line script with argument parsing, a handful of small functions and
+  simple file I/O: 3/10.
+- A REST endpoint module with request validation, database queries through an
+  ORM and error responses: 5/10.
+- A class hierarchy implementing a plugin system with dynamic registration and
+  lifecycle hooks: 7/10.
+- An incremental parser with error recovery, or a lock-free concurrent data
+  structure: 9/10.
+
+Common signals that raise the score:
+- Functions longer than about 50 lines or nested more than three levels deep.
+- Mutable global state, module-level side effects or hidden singletons.
+- Broad exception handlers that silently swallow errors.
+- Threads, processes, async tasks or callbacks that share state.
+- Clever one-liners, heavy use of comprehensions with side effects, or
+  unusual operator overloading.
+
+Common signals that lower the score:
+- Small pure functions with type hints and docstrings.
+- Clear separation between I/O and logic.
+- Existing tests or examples that demonstrate the expected behaviour.
+- Consistent naming that mirrors the problem domain.
+
+How to read the file:
+- Start from the public entry points (module-level functions, classes without
+  a leading underscore, and any __main__ block) and follow the calls inward.
+- Note which names come from imports; unfamiliar third-party APIs add to the
+  learning curve even when the local code is short.
+- Treat decorators, context managers and generators as control flow, since they
+  change when and how often code runs.
+- Look for comments that explain why, not just what; their absence around
+  tricky logic is a strong signal that the code is harder than it looks.
+
+Be consistent: identical code must always receive the identical score. Do not
+reward or penalise code for its domain alone; judge the code that is shown. If
+the file is truncated, score what is visible and do not speculate about the rest.
+
+While reading, note which aspects are beginner friendly and which parts are
+challenging, then turn that into concrete, actionable suggestions that would make
+the code easier for a newcomer to work on (for example: extract a helper, add a
+docstring, reduce nesting, add type hints, split a long function, name a magic
+number). Each suggestion should be a single sentence that names the function,
+class or region it applies to.
+
+Respond with a JSON object containing:
+- "score": the complexity rating, a number from 0 to 10 (decimals allowed).
+- "suggestions": at most five suggestions, most valuable first."""
+
+    def __init__(self, model: str = "gpt-4o", api_key: Optional[str] = None,
+                 max_concurrency: int = 10, cache: Optional[ResponseCache] = None,
+                 http_client: Optional[httpx.AsyncClient] = None):
         self.model = model
-        self.client = openai.OpenAI(api_key=api_key)
+        self.cache = cache
+        # Retries are handled by _create_completion, so disable the client's own
+        self.client = openai.AsyncOpenAI(api_key=api_key, max_retries=0, http_client=http_client)
+        self._sem = asyncio.Semaphore(max_concurrency)
 
-    def analyze_file(self, file_path: str) -> ComplexityScore:
+    async def analyze_files(self, paths: List[str]) -> List[ComplexityScore]:
+        """Analyze several files concurrently, preserving input order."""
+        return await asyncio.gather(*(self.analyze_file(p) for p in paths))
+
+    async def analyze_file(self, file_path: str) -> ComplexityScore:
         """Analyze a single file for complexity."""
-        with open(file_path, 'r') as f:
-            code = f.read()
+        code = await self._read(file_path)
 
         # Static analysis
         static_metrics = self._static_analysis(code)
 
         # AI analysis
-        ai_insights = self._ai_analysis(code)
+        ai_insights = await self._ai_analysis(code)
+
+        return self._build_score(static_metrics, ai_insights)
+
+    @staticmethod
+    def aggregate_score(results: List[ComplexityScore]) -> float:
+        """Repository-level score: file scores averaged, weighted by lines of code."""
+        if not results:
+            return 0.0
+
+        total_lines = sum(r.metrics['lines_of_code'] for r in results)
+        if total_lines == 0:
+            return round(sum(r.score for r in results) / len(results), 2)
+        return round(sum(r.score * r.metrics['lines_of_code'] for r in results) / total_lines, 2)
+
+    async def analyze_file_stream(self, file_path: str) -> AsyncIterator[Dict]:
+        """Analyze a file, yielding progress events as they become available.
+
+        Events are dicts with an 'event' key: 'metrics' (static metrics, sent
+        first), 'ai_score' (as soon as the streamed response contains it) and
+        finally 'result' with the full ComplexityScore.
+        """
+        code = await self._read(file_path)
+        static_metrics = self._static_analysis(code)
+        yield {'event': 'metrics', 'metrics': static_metrics}
+
+        snippet = code[:2000]
+        ai_insights = await self._cached_insights(snippet)
+        if ai_insights is None:
+            content = ''
+            score_sent = False
+            async for delta in self._stream_completion(self._completion_body(snippet)):
+                content += delta
+                if not score_sent:
+                    match = PARTIAL_SCORE_RE.search(content)
+                    if match:
+                        score_sent = True
+                        yield {'event': 'ai_score', 'ai_score': _clamp_score(match.group(1))}
+
+            ai_insights = self._parse_response(content)
+            await self._cache_insights(snippet, ai_insights)
 
-        # Combine results
+        yield {'event': 'result', 'result': self._build_score(static_metrics, ai_insights)}
+
+    async def analyze_repository_batch(self, paths: List[str],
+                                       poll_interval: float = 30) -> Dict[str, ComplexityScore]:
+        """Analyze many files through the Batch API (cheaper, but up to 24h turnaround)."""
+        submission = await self.submit_batch(paths)
+        return await self.wait_for_batch(submission, poll_interval)
+
+    async def submit_batch(self, paths: List[str]) -> BatchSubmission:
+        """Upload one chat completion request per file and start a batch job."""
+        lines = []
+        snippet_keys = {}
+        for path in paths:
+            snippet = (await self._read(path))[:2000]
+            snippet_keys[path] = self._cache_key(snippet)
+            lines.append(json.dumps({
+                "custom_id": path,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._completion_body(snippet),
+            }))
+
+        batch_file = await self.client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode()),
+            purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return BatchSubmission(batch_id=batch.id, snippet_keys=snippet_keys)
+
+    async def wait_for_batch(self, submission: BatchSubmission,
+                             poll_interval: float = 30) -> Dict[str, ComplexityScore]:
+        """Poll a batch until it finishes and map its results back to file paths.
+
+        Files are left out of the result if their request failed or was refused
+        inside the batch, or if they were changed or deleted since submission.
+        """
+        batch_id = submission.batch_id
+        batch = await self.client.batches.retrieve(batch_id)
+        while batch.status not in BATCH_DONE_STATES:
+            await asyncio.sleep(poll_interval)
+            batch = await self.client.batches.retrieve(batch_id)
+
+        if batch.status != 'completed':
+            raise RuntimeError(f"Batch {batch_id} ended with status '{batch.status}'")
+        if batch.output_file_id is None:
+            # Every request in the batch failed
+            return {}
+
+        output = await self.client.files.content(batch.output_file_id)
+        results = {}
+        for line in output.text.splitlines():
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                path = record['custom_id']
+                snippet_key = submission.snippet_keys[path]
+                response = record.get('response')
+                if not response or response['status_code'] != 200:
+                    continue
+                insights = self._parse_response(response['body']['choices'][0]['message']['content'])
+            except (ValueError, KeyError, IndexError, TypeError):
+                # Malformed record or refusal; keep the rest of the batch
+                continue
+
+            # The insights belong to the submitted snippet, so they can be cached
+            # under its key even if the file has changed since
+            if self.cache is not None:
+                await self.cache.set(snippet_key, insights)
+
+            try:
+                code = await self._read(path)
+            except (OSError, ValueError):
+                continue
+            if self._cache_key(code[:2000]) != snippet_key:
+                continue
+            results[path] = self._build_score(self._static_analysis(code), insights)
+        return results
+
+    @staticmethod
+    async def _read(file_path: str) -> str:
+        """Read a source file without blocking the event loop."""
+        async with aiofiles.open(file_path, 'r') as f:
+            return await f.read()
+
+    def _build_score(self, static_metrics: Dict, ai_insights: Dict) -> ComplexityScore:
+        """Combine static metrics and AI insights into a ComplexityScore."""
         final_score = self._calculate_final_score(static_metrics, ai_insights)
 
         return ComplexityScore(
@@ -46,68 +353,85 @@ class CodeAnalyzer:
 
     def _static_analysis(self, code: str) -> Dict[str, float]:
         """Perform static code analysis."""
-        try:
-            tree = ast.parse(code)
-
-            metrics = {
-                'lines_of_code': len(code.split('\n')),
-                'functions': len([n for n in ast.walk(tree) if isinstance(n, ast.FunctionDef)]),
-                'classes': len([n for n in ast.walk(tree) if isinstance(n, ast.ClassDef)]),
-                'complexity': self._cyclomatic_complexity(tree),
-            }
+        return dict(_static_metrics(code))
 
-            return metrics
-        except SyntaxError:
-            return {'lines_of_code': 0, 'functions': 0, 'classes': 0, 'complexity': 0}
+    async def _ai_analysis(self, code: str) -> Dict:
+        """Use GPT-4 to analyze code complexity."""
+        snippet = code[:2000]  # Limit to first 2000 chars
+        cached = await self._cached_insights(snippet)
+        if cached is not None:
+            return cached
 
-    def _cyclomatic_complexity(self, tree: ast.AST) -> int:
-        """Calculate cyclomatic complexity."""
-        complexity = 1
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.If, ast.While, ast.For, ast.ExceptHandler)):
-                complexity += 1
-        return complexity
+        response = await self._create_completion(**self._completion_body(snippet))
+        insights = self._parse_response(response.choices[0].message.content)
 
-    def _ai_analysis(self, code: str) -> Dict:
-        """Use GPT-4 to analyze code complexity."""
-        prompt = f"""Analyze this code for complexity and provide:
-1. Overall complexity rating (0-10)
-2. Beginner-friendly aspects
-3. Challenging parts
-4. Suggestions for improvements
-
-Code:
-```python
-{code[:2000]}  # Limit to first 2000 chars
-```
-"""
+        await self._cache_insights(snippet, insights)
+        return insights
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": "You are a code complexity expert."},
-                {"role": "user", "content": prompt}
+    def _completion_body(self, snippet: str) -> Dict:
+        """Build the chat completion request for a code snippet."""
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": f"```python\n{snippet}\n```"}
             ],
-            temperature=0.3
-        )
+            "temperature": 0,  # Deterministic output so cached responses stay valid
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "complexity", "schema": RESPONSE_SCHEMA, "strict": True}
+            }
+        }
+
+    def _cache_key(self, snippet: str) -> str:
+        """Cache key for a snippet; changing the prompt invalidates old entries."""
+        return ResponseCache.make_key(self.model, self.SYSTEM_PROMPT, snippet)
+
+    async def _cached_insights(self, snippet: str) -> Optional[Dict]:
+        """Cached AI insights for a snippet, or None on a miss or without a cache."""
+        if self.cache is None:
+            return None
+        return await self.cache.get(self._cache_key(snippet))
+
+    async def _cache_insights(self, snippet: str, insights: Dict):
+        """Store AI insights for a snippet if a cache is configured."""
+        if self.cache is not None:
+            await self.cache.set(self._cache_key(snippet), insights)
 
-        content = response.choices[0].message.content
+    async def _stream_completion(self, body: Dict) -> AsyncIterator[str]:
+        """Stream completion text under the concurrency limit.
 
+        Opening the stream is retried like any other request; once chunks have
+        started arriving a failure is raised, since it can't be replayed.
+        """
+        async with self._sem:
+            # Closing releases the connection even if the caller stops reading early
+            async with await self._open_stream(**body) as stream:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+
+    def _parse_response(self, content: Optional[str]) -> Dict:
+        """Turn a structured completion into AI insights."""
+        if content is None:
+            raise ValueError("AI response has no content (the request may have been refused)")
+
+        data = json.loads(content)
         return {
-            'ai_score': self._extract_score(content),
-            'suggestions': self._extract_suggestions(content)
+            'ai_score': _clamp_score(data['score']),
+            'suggestions': data['suggestions'][:5]
         }
 
-    def _extract_score(self, content: str) -> float:
-        """Extract numerical score from AI response."""
-        match = re.search(r'(\d+(\.\d+)?)/10', content)
-        return float(match.group(1)) if match else 5.0
+    @_retry_transient
+    async def _create_completion(self, **kwargs):
+        """Call the chat completions API under the concurrency limit."""
+        async with self._sem:
+            return await self.client.chat.completions.create(**kwargs)
 
-    def _extract_suggestions(self, content: str) -> List[str]:
-        """Extract suggestions from AI response."""
-        lines = content.split('\n')
-        suggestions = [line.strip('- ').strip() for line in lines if line.strip().startswith('-')]
-        return suggestions[:5]  # Top 5 suggestions
+    @_retry_transient
+    async def _open_stream(self, **kwargs):
+        """Open a streaming chat completion; the caller holds the semaphore."""
+        return await self.client.chat.completions.create(**kwargs, stream=True)
 
     def _calculate_final_score(self, static: Dict, ai: Dict) -> float:
         """Combine static and AI scores."""
@@ -122,10 +446,56 @@ Code:
         return round(final, 2)
 
 
+# Node types that add a decision point to cyclomatic complexity
+BRANCH_NODES = (ast.If, ast.While, ast.For, ast.ExceptHandler)
+
+
+# In-process cache of static metrics, keyed by a digest of the source so the
+# cache doesn't hold on to whole files
+STATIC_CACHE_SIZE = 1024
+_static_cache: "OrderedDict[bytes, Tuple[Tuple[str, float], ...]]" = OrderedDict()
+
+
+def _static_metrics(code: str) -> Tuple[Tuple[str, float], ...]:
+    """Static metrics for a source string, memoized by content.
+
+    Returned as a tuple of items so cached results can't be mutated by callers.
+    """
+    digest = hashlib.blake2b(code.encode(), digest_size=16).digest()
+    metrics = _static_cache.get(digest)
+    if metrics is not None:
+        _static_cache.move_to_end(digest)
+        return metrics
+
+    metrics = _compute_static_metrics(code)
+    _static_cache[digest] = metrics
+    if len(_static_cache) > STATIC_CACHE_SIZE:
+        _static_cache.popitem(last=False)
+    return metrics
+
+
+def _compute_static_metrics(code: str) -> Tuple[Tuple[str, float], ...]:
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return (('lines_of_code', 0), ('functions', 0), ('classes', 0), ('complexity', 0))
+
+    # Tally node types in a single traversal; Counter does the counting in C.
+    # None of the counted node types have subclasses, so exact type matches suffice.
+    node_counts = Counter(map(type, ast.walk(tree)))
+
+    return (
+        ('lines_of_code', code.count('\n') + 1),
+        ('functions', node_counts[ast.FunctionDef]),
+        ('classes', node_counts[ast.ClassDef]),
+        ('complexity', sum(node_counts[t] for t in BRANCH_NODES) + 1),
+    )
+
+
 # Example usage
 if __name__ == "__main__":
     analyzer = CodeAnalyzer()
-    result = analyzer.analyze_file("example.py")
+    result = asyncio.run(analyzer.analyze_file("example.py"))
     print(f"Complexity: {result.score}/10")
     print(f"Beginner-friendly: {result.suitable_for_beginner}")
     print(f"Suggestions: {result.suggestions}")
@@ -1,37 +1,95 @@
 """
 FastAPI application entry point.
 """
-from fastapi import FastAPI, HTTPException, Depends
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
+import anyio
+import asyncio
+import httpx
+import orjson
+import os
 import uvicorn
 
-from src.ai_engine.code_analyzer import CodeAnalyzer
+from src.ai_engine.cache import ResponseCache
+from src.ai_engine.code_analyzer import CodeAnalyzer, ComplexityScore
+from src.api.batching import MicroBatcher
 from src.ml_models.issue_classifier import IssueDifficultyClassifier
 from src.database import get_db
 from src.models import Issue, Repository
 from src.schemas import IssueCreate, IssueResponse, AnalysisRequest, AnalysisResponse
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the AI components for this worker and release them on shutdown."""
+    # Blocking model inference runs in worker threads; allow more than the default 40
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 100
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=100)) as http_client:
+        response_cache = ResponseCache(os.getenv("REDIS_URL", "redis://localhost:6379"))
+        app.state.code_analyzer = CodeAnalyzer(
+            max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "10")),
+            cache=response_cache,
+            http_client=http_client
+        )
+        issue_classifier = IssueDifficultyClassifier(
+            serving_address=os.getenv("TF_SERVING_ADDRESS")
+        )
+        app.state.issue_batcher = MicroBatcher(issue_classifier.predict_batch)
+        app.state.issue_batcher.start()
+
+        yield
+
+        await app.state.issue_batcher.stop()
+        await response_cache.close()
+
+
+def get_code_analyzer(request: Request) -> CodeAnalyzer:
+    return request.app.state.code_analyzer
+
+
+def get_issue_batcher(request: Request) -> MicroBatcher:
+    return request.app.state.issue_batcher
+
+
+def _to_response(result: ComplexityScore) -> AnalysisResponse:
+    return AnalysisResponse(
+        score=result.score,
+        metrics=result.metrics,
+        suggestions=result.suggestions,
+        beginner_friendly=result.suitable_for_beginner
+    )
+
+
 app = FastAPI(
     title="GitStart API",
     description="AI-powered contributor onboarding platform",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# CORS middleware
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
+    if origin.strip()
+]
+
+# CORS middleware, limited to the configured frontend origins
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# Initialize AI components
-code_analyzer = CodeAnalyzer()
-issue_classifier = IssueDifficultyClassifier()
-
 
 @app.get("/")
 async def root():
@@ -39,24 +97,89 @@ async def root():
 
 
 @app.post("/api/v1/analyze/code", response_model=AnalysisResponse)
-async def analyze_code(request: AnalysisRequest):
+async def analyze_code(request: AnalysisRequest,
+                       code_analyzer: CodeAnalyzer = Depends(get_code_analyzer)):
     """Analyze code complexity using AI."""
     try:
-        result = code_analyzer.analyze_file(request.file_path)
-        return AnalysisResponse(
-            score=result.score,
-            metrics=result.metrics,
-            suggestions=result.suggestions,
-            beginner_friendly=result.suitable_for_beginner
-        )
+        result = await code_analyzer.analyze_file(request.file_path)
+        return _to_response(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/v1/analyze/code/stream")
+async def analyze_code_stream(request: AnalysisRequest,
+                              code_analyzer: CodeAnalyzer = Depends(get_code_analyzer)):
+    """Analyze code complexity, streaming progress as newline-delimited JSON."""
+    async def events():
+        try:
+            async for event in code_analyzer.analyze_file_stream(request.file_path):
+                if event['event'] == 'result':
+                    event.update(_to_response(event.pop('result')).model_dump())
+                yield orjson.dumps(event) + b"\n"
+        except Exception as e:
+            # Headers are already sent, so report failures in-band
+            yield orjson.dumps({'event': 'error', 'detail': str(e)}) + b"\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+class BatchAnalysisRequest(BaseModel):
+    paths: List[str]
+
+
+@app.post("/api/v1/analyze/batch")
+async def analyze_batch(request: BatchAnalysisRequest,
+                        code_analyzer: CodeAnalyzer = Depends(get_code_analyzer)):
+    """Analyze many files concurrently, streaming each result as it finishes.
+
+    Emits one NDJSON 'result' (or 'error') event per file in completion order,
+    then a 'summary' event with the repository-level score.
+    """
+    async def analyze(path: str):
+        try:
+            return path, await code_analyzer.analyze_file(path), None
+        except Exception as e:
+            return path, None, e
+
+    async def events():
+        # AI calls are still capped by the analyzer's concurrency limit
+        tasks = [asyncio.ensure_future(analyze(path)) for path in request.paths]
+        results = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                path, result, error = await next_done
+                if error is not None:
+                    event = {'event': 'error', 'path': path, 'detail': str(error)}
+                else:
+                    results.append(result)
+                    event = {'event': 'result', 'path': path, **_to_response(result).model_dump()}
+                yield orjson.dumps(event) + b"\n"
+
+            yield orjson.dumps({
+                'event': 'summary',
+                'score': CodeAnalyzer.aggregate_score(results),
+                'analyzed': len(results),
+                'failed': len(tasks) - len(results),
+            }) + b"\n"
+        finally:
+            # Stop outstanding work if the client disconnects
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+class ClassifyRequest(BaseModel):
+    issue_text: str
+
+
 @app.post("/api/v1/issues/classify")
-async def classify_issue(issue_text: str):
+async def classify_issue(request: ClassifyRequest,
+                         issue_batcher: MicroBatcher = Depends(get_issue_batcher)):
     """Classify issue difficulty using ML."""
-    difficulty, confidence = issue_classifier.predict(issue_text)
+    # Concurrent requests are batched into one forward pass off the event loop
+    difficulty, confidence = await issue_batcher.submit(request.issue_text)
     return {
         "difficulty": difficulty,
         "confidence": confidence,
@@ -65,10 +188,10 @@ async def classify_issue(issue_text: str):
 
 
 @app.get("/api/v1/issues/beginner", response_model=List[IssueResponse])
-async def get_beginner_issues(db: Session = Depends(get_db), limit: int = 20):
+async def get_beginner_issues(db: AsyncSession = Depends(get_db), limit: int = 20):
     """Get beginner-friendly issues."""
-    issues = db.query(Issue).filter(Issue.difficulty == "beginner").limit(limit).all()
-    return issues
+    result = await db.execute(select(Issue).where(Issue.difficulty == "beginner").limit(limit))
+    return result.scalars().all()
 
 
 @app.get("/health")
@@ -77,4 +200,11 @@ async def health_check():
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "src.api.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1"))
+    )
@@ -3,19 +3,165 @@ ML model for classifying issue difficulty using TensorFlow.
 """
 import tensorflow as tf
 import numpy as np
-from typing import List, Tuple
+import functools
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
 from transformers import AutoTokenizer, TFAutoModel
 import pickle
 
+# Keyword patterns for FeatureExtractor (case-insensitive substring matches)
+ERROR_WORDS = re.compile('error|bug|exception', re.IGNORECASE)
+COMPLEXITY_WORDS = re.compile('implement|refactor|optimize|architecture', re.IGNORECASE)
+
 
 class IssueDifficultyClassifier:
     """Classify GitHub issues by difficulty level."""
 
     DIFFICULTY_LEVELS = ['beginner', 'intermediate', 'advanced', 'expert']
 
-    def __init__(self, model_path: str = "models/issue_classifier"):
+    # Batches are padded up to these lengths and to a power-of-two row count,
+    # so the TFLite interpreter and TF Serving only see a handful of input shapes
+    SEQUENCE_BUCKETS = (32, 64, 128, 256, 512)
+
+    def __init__(self, model_path: str = "models/issue_classifier",
+                 serving_address: Optional[str] = None,
+                 serving_model: str = "issue_classifier"):
         self.tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")
-        self.model = self._load_model(model_path)
+        self.model_path = model_path
+        self.model: Optional[tf.keras.Model] = None
+        self.serving_model = serving_model
+        # Repeat submissions of the same issue skip tokenization
+        self._encode = functools.lru_cache(maxsize=8192)(self._tokenize)
+
+        # With TF Serving, the weights live in one shared server process instead
+        # of every worker; otherwise prefer the INT8 model written by
+        # export_quantized (unless the Keras model has been saved since) and
+        # fall back to FP32 Keras
+        self._interpreter = None if serving_address else self._load_quantized(model_path + ".tflite")
+        if serving_address:
+            self._serving_stub = self._connect_serving(serving_address)
+            self._infer = self._forward_remote
+            # Collate to whatever signature the served model version expects
+            self._serving_inputs, seq_len = self._serving_signature()
+            self._uses_mask = 'attention_mask' in self._serving_inputs
+        elif self._interpreter is not None:
+            self._interpreter_lock = threading.Lock()
+            self._infer = self._forward_quantized
+            input_details = self._interpreter.get_input_details()
+            seq_len = input_details[0]['shape_signature'][1]
+            self._uses_mask = len(input_details) > 1
+        else:
+            self._use_keras(self._load_model(model_path))
+            return
+
+        # Models saved before dynamic padding take a fixed sequence length
+        self._fixed_seq_len = seq_len if seq_len and seq_len > 0 else None
+
+    def _use_keras(self, model: tf.keras.Model):
+        """Serve predictions from an in-process Keras model."""
+        self.model = model
+        self._interpreter = None
+        # Models saved before the attention mask was added take input_ids only
+        self._uses_mask = len(model.inputs) > 1
+        seq_len = model.inputs[0].shape[1]
+        self._fixed_seq_len = seq_len if seq_len else None
+
+        # One traced graph for every batch shape; avoids model.predict's
+        # per-call overhead without compiling per shape on the request path
+        input_spec = {name: tf.TensorSpec([None, None], tf.int32) for name in self._input_names()}
+        self._compiled_forward = tf.function(self._forward, input_signature=[input_spec])
+        self._infer = self._forward_keras
+
+    def _input_names(self) -> List[str]:
+        return ['input_ids', 'attention_mask'] if self._uses_mask else ['input_ids']
+
+    def _forward(self, inputs: Dict[str, tf.Tensor]) -> tf.Tensor:
+        if self._uses_mask:
+            return self.model(inputs, training=False)
+        return self.model(inputs['input_ids'], training=False)
+
+    def _forward_keras(self, inputs: Dict[str, np.ndarray]) -> tf.Tensor:
+        return self._compiled_forward({name: tf.convert_to_tensor(value) for name, value in inputs.items()})
+
+    def _forward_quantized(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        # The interpreter holds per-call state, so only one batch may run at a time
+        with self._interpreter_lock:
+            input_details = self._interpreter.get_input_details()
+            for detail in input_details:
+                self._interpreter.resize_tensor_input(
+                    detail['index'], inputs[self._input_key(detail['name'])].shape
+                )
+            self._interpreter.allocate_tensors()
+            for detail in input_details:
+                self._interpreter.set_tensor(detail['index'], inputs[self._input_key(detail['name'])])
+            self._interpreter.invoke()
+            output_index = self._interpreter.get_output_details()[0]['index']
+            return self._interpreter.get_tensor(output_index)
+
+    @staticmethod
+    def _input_key(tensor_name: str) -> str:
+        """Map a converted model's input tensor name to the collated input it takes."""
+        return 'attention_mask' if 'attention_mask' in tensor_name else 'input_ids'
+
+    def _forward_remote(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        from tensorflow_serving.apis import predict_pb2
+
+        request = predict_pb2.PredictRequest()
+        request.model_spec.name = self.serving_model
+        request.model_spec.signature_name = 'serving_default'
+        for key, value in inputs.items():
+            request.inputs[self._serving_inputs[key]].CopyFrom(tf.make_tensor_proto(value))
+        response = self._serving_stub.Predict(request, timeout=10.0)
+        # The signature has a single output (the softmax layer)
+        return tf.make_ndarray(next(iter(response.outputs.values())))
+
+    def _connect_serving(self, address: str):
+        """Open a gRPC channel to a TF Serving instance (e.g. 'localhost:8500')."""
+        # Only needed when serving remotely, so imported lazily
+        import grpc
+        from tensorflow_serving.apis import prediction_service_pb2_grpc
+
+        channel = grpc.insecure_channel(address)
+        return prediction_service_pb2_grpc.PredictionServiceStub(channel)
+
+    def _serving_signature(self) -> Tuple[Dict[str, str], Optional[int]]:
+        """Read the served model's serving_default inputs.
+
+        Returns the signature's input name for each collated input, and the
+        fixed sequence length if the model has one.
+        """
+        from tensorflow_serving.apis import get_model_metadata_pb2
+
+        request = get_model_metadata_pb2.GetModelMetadataRequest()
+        request.model_spec.name = self.serving_model
+        request.metadata_field.append('signature_def')
+        response = self._serving_stub.GetModelMetadata(request, timeout=10.0)
+
+        signatures = get_model_metadata_pb2.SignatureDefMap()
+        response.metadata['signature_def'].Unpack(signatures)
+        signature = signatures.signature_def['serving_default']
+
+        inputs = {self._input_key(name): name for name in signature.inputs}
+        dims = signature.inputs[inputs['input_ids']].tensor_shape.dim
+        seq_len = dims[1].size if len(dims) > 1 else None
+        return inputs, seq_len
+
+    def _load_quantized(self, path: str) -> Optional[tf.lite.Interpreter]:
+        """Load a quantized TFLite model if one was exported after the Keras model was last saved."""
+        if not os.path.exists(path):
+            return None
+        keras_saved = _modified_time(self.model_path)
+        if keras_saved is not None and keras_saved > os.path.getmtime(path):
+            return None
+        return tf.lite.Interpreter(model_path=path)
+
+    def _keras_model(self) -> tf.keras.Model:
+        """The FP32 Keras model, loaded on demand when serving from TFLite."""
+        if self.model is None:
+            self.model = self._load_model(self.model_path)
+        return self.model
 
     def _load_model(self, path: str) -> tf.keras.Model:
         """Load pre-trained model."""
@@ -25,23 +171,28 @@ class IssueDifficultyClassifier:
             # If model doesn't exist, create a new one
             return self._create_model()
 
-    def _create_model(self) -> tf.keras.Model:
+    def _create_model(self, encoder: Optional[tf.keras.layers.Layer] = None) -> tf.keras.Model:
         """Create neural network architecture."""
-        inputs = tf.keras.Input(shape=(512,), dtype=tf.int32)
+        input_ids = tf.keras.Input(shape=(None,), dtype=tf.int32, name='input_ids')
+        attention_mask = tf.keras.Input(shape=(None,), dtype=tf.int32, name='attention_mask')
 
         # BERT embedding layer
-        bert_model = TFAutoModel.from_pretrained("bert-base-uncased")
-        embeddings = bert_model(inputs)[0]
+        if encoder is None:
+            encoder = TFAutoModel.from_pretrained("bert-base-uncased")
+            # Keep the pre-trained token embeddings fixed; only fine-tune the encoder and head
+            encoder.get_input_embeddings().trainable = False
+        embeddings = encoder(input_ids, attention_mask=attention_mask)[0]
 
-        # Classification head
-        x = tf.keras.layers.GlobalAveragePooling1D()(embeddings)
+        # Classification head; padding is masked out of attention and pooling,
+        # so predictions don't depend on how far a batch is padded
+        x = tf.keras.layers.GlobalAveragePooling1D()(embeddings, mask=tf.cast(attention_mask, tf.bool))
         x = tf.keras.layers.Dense(256, activation='relu')(x)
         x = tf.keras.layers.Dropout(0.3)(x)
         x = tf.keras.layers.Dense(128, activation='relu')(x)
         x = tf.keras.layers.Dropout(0.2)(x)
         outputs = tf.keras.layers.Dense(4, activation='softmax')(x)
 
-        model = tf.keras.Model(inputs=inputs, outputs=outputs)
+        model = tf.keras.Model(inputs=[input_ids, attention_mask], outputs=outputs)
         model.compile(
             optimizer='adam',
             loss='sparse_categorical_crossentropy',
@@ -52,64 +203,175 @@ class IssueDifficultyClassifier:
 
     def predict(self, issue_text: str) -> Tuple[str, float]:
         """Predict difficulty level for an issue."""
-        # Tokenize
-        tokens = self.tokenizer(
-            issue_text,
-            max_length=512,
-            padding='max_length',
-            truncation=True,
-            return_tensors='tf'
-        )
+        return self.predict_batch([issue_text])[0]
+
+    def predict_batch(self, issue_texts: List[str]) -> List[Tuple[str, float]]:
+        """Predict difficulty levels for several issues in one forward pass."""
+        inputs = self._collate([self._encode(text) for text in issue_texts], pad_rows=True)
 
-        # Predict
-        predictions = self.model.predict(tokens['input_ids'], verbose=0)
-        predicted_class = np.argmax(predictions[0])
-        confidence = float(predictions[0][predicted_class])
+        # Predict, dropping the padding rows
+        predictions = np.asarray(self._infer(inputs))[:len(issue_texts)]
+        predicted_classes = np.argmax(predictions, axis=1)
 
-        difficulty = self.DIFFICULTY_LEVELS[predicted_class]
+        return [
+            (self.DIFFICULTY_LEVELS[cls], float(probs[cls]))
+            for cls, probs in zip(predicted_classes, predictions)
+        ]
 
-        return difficulty, confidence
+    def _tokenize(self, issue_text: str) -> Tuple[int, ...]:
+        """Token ids for an issue, truncated to 512 tokens and unpadded."""
+        return tuple(self.tokenizer(issue_text, max_length=512, truncation=True)['input_ids'])
+
+    def _collate_for(self, model: tf.keras.Model,
+                     encoded: List[Tuple[int, ...]]) -> Dict[str, np.ndarray]:
+        """Collate a batch for the given Keras model rather than the one serving predictions."""
+        return self._collate(encoded, uses_mask=len(model.inputs) > 1,
+                             fixed_seq_len=model.inputs[0].shape[1])
+
+    def _collate(self, encoded: List[Tuple[int, ...]], pad_rows: bool = False,
+                 uses_mask: Optional[bool] = None,
+                 fixed_seq_len: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Pad token ids into a bucketed batch with its attention mask.
+
+        With pad_rows, the row count is also padded to a power of two. The input
+        layout defaults to that of the model serving predictions.
+        """
+        if uses_mask is None:
+            uses_mask, fixed_seq_len = self._uses_mask, self._fixed_seq_len
+
+        longest = max(len(ids) for ids in encoded)
+        if fixed_seq_len:
+            length = fixed_seq_len
+        elif not uses_mask:
+            # Without a mask the model sees padding as tokens, so keep the
+            # length it was trained with
+            length = 512
+        else:
+            length = next(b for b in self.SEQUENCE_BUCKETS if b >= longest)
+        rows = 1 << (len(encoded) - 1).bit_length() if pad_rows else len(encoded)
+
+        input_ids = np.full((rows, length), self.tokenizer.pad_token_id, dtype=np.int32)
+        attention_mask = np.zeros((rows, length), dtype=np.int32)
+        # Padding rows attend to one position so their (discarded) pooling isn't 0/0
+        attention_mask[len(encoded):, 0] = 1
+        for i, ids in enumerate(encoded):
+            input_ids[i, :len(ids)] = ids
+            attention_mask[i, :len(ids)] = 1
+
+        if not uses_mask:
+            return {'input_ids': input_ids}
+        return {'input_ids': input_ids, 'attention_mask': attention_mask}
 
     def train(self, issues: List[str], labels: List[int], epochs: int = 10):
         """Train the model on labeled issues."""
-        # Tokenize all issues
-        tokens = self.tokenizer(
-            issues,
-            max_length=512,
-            padding='max_length',
-            truncation=True,
-            return_tensors='tf'
-        )
+        model = self._keras_model()
+
+        # Tokenize and pad exactly as at inference time
+        inputs = self._collate_for(model, [self._tokenize(issue) for issue in issues])
 
         # Train
-        self.model.fit(
-            tokens['input_ids'],
+        model.fit(
+            inputs,
             np.array(labels),
             epochs=epochs,
             batch_size=32,
             validation_split=0.2
         )
 
+        # Any quantized or served copy is now stale; predict with the trained model
+        self._use_keras(model)
+
     def save(self, path: str):
         """Save model to disk."""
-        self.model.save(path)
+        self._keras_model().save(path)
+
+    def export_for_serving(self, base_path: str = "models/serving", version: int = 1) -> str:
+        """Export a SavedModel in the <base>/<model name>/<version> layout TF Serving expects."""
+        path = os.path.join(base_path, self.serving_model, str(version))
+        model = self._keras_model()
+
+        # Pin the signature to named inputs of any batch size (and any length,
+        # unless the model has a fixed one), so the served model accepts the same
+        # bucketed batches as in-process inference
+        seq_len = model.inputs[0].shape[1]
+        input_spec = {
+            name: tf.TensorSpec([None, seq_len], tf.int32, name=name)
+            for name in ['input_ids', 'attention_mask'][:len(model.inputs)]
+        }
+
+        @tf.function(input_signature=[input_spec])
+        def serving_default(inputs):
+            if len(inputs) == 1:
+                return {'probabilities': model(inputs['input_ids'], training=False)}
+            return {'probabilities': model(inputs, training=False)}
+
+        model.save(path, save_format='tf', signatures={'serving_default': serving_default})
+        return path
+
+    def export_quantized(self, path: str, representative_issues: Optional[List[str]] = None):
+        """Export an INT8-quantized TFLite copy of the model.
+
+        Without representative issues, weights are quantized to INT8 (dynamic range).
+        With them, activations are calibrated too for full integer inference; ops
+        with no INT8 kernel fall back to float.
+        """
+        model = self._keras_model()
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+        if representative_issues:
+            # Collated as at inference, but to one bucket: the calibrator can't
+            # change sequence length between samples. The mask keeps the extra
+            # padding out of the model's output.
+            inputs = self._collate_for(model, [self._tokenize(issue) for issue in representative_issues])
+
+            def representative_dataset():
+                for i in range(len(representative_issues)):
+                    # Keyed by name: the converted graph may order its inputs differently
+                    yield {name: value[i:i + 1] for name, value in inputs.items()}
+
+            converter.representative_dataset = representative_dataset
+            converter.target_spec.supported_ops = [
+                tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+                tf.lite.OpsSet.TFLITE_BUILTINS,
+            ]
+
+        with open(path, 'wb') as f:
+            f.write(converter.convert())
+
+
+def _modified_time(path: str) -> Optional[float]:
+    """Latest modification time of a file or anything inside a directory, or None if missing."""
+    if not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        return os.path.getmtime(path)
+    return max(
+        [os.path.getmtime(os.path.join(root, name))
+         for root, _, names in os.walk(path) for name in names] + [os.path.getmtime(path)]
+    )
 
 
 # Feature extraction for traditional ML models
 class FeatureExtractor:
     """Extract features from issue text."""
 
+    FEATURE_NAMES = ['length', 'word_count', 'has_code', 'has_error', 'complexity_words']
+
     def extract(self, text: str) -> np.ndarray:
         """Extract numerical features."""
-        features = {
-            'length': len(text),
-            'word_count': len(text.split()),
-            'has_code': 1 if '```' in text else 0,
-            'has_error': 1 if any(word in text.lower() for word in ['error', 'bug', 'exception']) else 0,
-            'complexity_words': sum(1 for word in ['implement', 'refactor', 'optimize', 'architecture'] if word in text.lower()),
-        }
+        return np.array([
+            len(text),
+            len(text.split()),
+            '```' in text,
+            ERROR_WORDS.search(text) is not None,
+            len({m.lower() for m in COMPLEXITY_WORDS.findall(text)}),
+        ], dtype=np.float32)
 
-        return np.array(list(features.values()))
+    def extract_batch(self, texts: List[str]) -> np.ndarray:
+        """Extract features for many issues as a (n_issues, n_features) array."""
+        features = np.array([self.extract(text) for text in texts], dtype=np.float32)
+        return features.reshape(len(texts), len(self.FEATURE_NAMES))
 
 
 if __name__ == "__main__":
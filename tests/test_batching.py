@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+from src.api.batching import MicroBatcher
+
+
+class TestMicroBatcher:
+    def test_concurrent_requests_share_a_batch(self):
+        batches = []
+
+        def batch_fn(items):
+            batches.append(list(items))
+            return [item * 2 for item in items]
+
+        async def run():
+            batcher = MicroBatcher(batch_fn, max_batch_size=8, max_wait_ms=50)
+            batcher.start()
+            try:
+                return await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+            finally:
+                await batcher.stop()
+
+        assert asyncio.run(run()) == [0, 2, 4, 6, 8]
+        assert batches == [[0, 1, 2, 3, 4]]
+
+    def test_batch_error_propagates(self):
+        def batch_fn(items):
+            raise RuntimeError("boom")
+
+        async def run():
+            batcher = MicroBatcher(batch_fn)
+            batcher.start()
+            try:
+                await batcher.submit("x")
+            finally:
+                await batcher.stop()
+
+        with pytest.raises(RuntimeError, match="boom"):
+            asyncio.run(run())
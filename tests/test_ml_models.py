@@ -0,0 +1,116 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from src.ml_models import issue_classifier
+from src.ml_models.issue_classifier import IssueDifficultyClassifier
+
+
+class FakeTokenizer:
+    pad_token_id = 0
+
+    def __call__(self, text, max_length=512, truncation=True):
+        ids = [1] + [5 + sum(map(ord, word)) % 90 for word in text.split()] + [2]
+        return {'input_ids': ids[:max_length]}
+
+
+class TinyEncoder(tf.keras.layers.Layer):
+    """Stand-in for BERT: embeddings plus one attention layer that honours the mask."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.embed = tf.keras.layers.Embedding(100, 8)
+        self.attention = tf.keras.layers.MultiHeadAttention(num_heads=2, key_dim=4)
+
+    def call(self, input_ids, attention_mask=None):
+        x = self.embed(input_ids)
+        mask = tf.expand_dims(tf.cast(attention_mask, tf.bool), 1)
+        return (self.attention(x, x, attention_mask=mask),)
+
+
+class ScaledEmbedding(tf.keras.layers.Layer):
+    """Embeddings whose magnitude grows with the token id, so calibrating on the wrong input clips real tokens."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        weights = np.random.default_rng(0).standard_normal((100, 8)) * np.arange(100)[:, None] / 10
+        self.embed = tf.keras.layers.Embedding(
+            100, 8, embeddings_initializer=tf.keras.initializers.Constant(weights)
+        )
+
+    def call(self, input_ids, attention_mask=None):
+        return (self.embed(input_ids),)
+
+
+class TestIssueDifficultyClassifier:
+    @pytest.fixture
+    def classifier(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(issue_classifier.AutoTokenizer, 'from_pretrained',
+                            lambda name: FakeTokenizer())
+        monkeypatch.setattr(IssueDifficultyClassifier, '_load_model',
+                            lambda self, path: self._create_model(encoder=TinyEncoder()))
+        return IssueDifficultyClassifier(model_path=str(tmp_path / "model"))
+
+    def test_prediction_does_not_depend_on_batch_padding(self, classifier):
+        issue = "Fix typo in README"
+        long_issue = " ".join(["word"] * 200)
+
+        alone = classifier._infer(classifier._collate([classifier._encode(issue)], pad_rows=True))
+        batched = classifier._infer(classifier._collate(
+            [classifier._encode(issue), classifier._encode(long_issue), classifier._encode(issue)],
+            pad_rows=True
+        ))
+
+        np.testing.assert_allclose(np.asarray(alone)[0], np.asarray(batched)[0], atol=1e-5)
+        np.testing.assert_allclose(np.asarray(alone)[0], np.asarray(batched)[2], atol=1e-5)
+        assert classifier.predict(issue) == classifier.predict_batch([long_issue, issue])[1]
+
+    def test_inference_graph_is_traced_once(self, classifier):
+        classifier.predict("Fix typo")
+        classifier.predict_batch(["Add a button"] * 3 + [" ".join(["word"] * 100)])
+        assert classifier._compiled_forward.experimental_get_tracing_count() == 1
+
+    def test_stale_quantized_model_is_ignored(self, classifier, tmp_path):
+        quantized = tmp_path / "model.tflite"
+        quantized.write_bytes(b"")
+        (tmp_path / "model").mkdir()
+        (tmp_path / "model" / "saved_model.pb").write_bytes(b"")
+        os.utime(quantized, (0, 0))
+
+        assert classifier._load_quantized(str(quantized)) is None
+
+    def test_train_switches_back_to_keras(self, classifier):
+        classifier._infer = None
+        classifier.train(["Fix typo", "Rewrite the scheduler"] * 5, [0, 2] * 5, epochs=1)
+        assert classifier._infer == classifier._forward_keras
+
+    def test_serving_signature_takes_any_length(self, classifier, tmp_path):
+        path = classifier.export_for_serving(str(tmp_path / "serving"))
+        serving_default = tf.saved_model.load(path).signatures['serving_default']
+
+        inputs = classifier._collate([classifier._encode("Fix typo in README")])
+        served = serving_default(**{name: tf.constant(value) for name, value in inputs.items()})
+
+        np.testing.assert_allclose(served['probabilities'], classifier._infer(inputs), atol=1e-5)
+
+    def test_calibrated_quantized_model_matches_keras(self, classifier, monkeypatch, tmp_path):
+        # Attention doesn't quantize closely enough to compare, so use embeddings alone
+        monkeypatch.setattr(IssueDifficultyClassifier, '_load_model',
+                            lambda self, path: self._create_model(encoder=ScaledEmbedding()))
+        tf.keras.utils.set_random_seed(0)
+        model = IssueDifficultyClassifier(model_path=str(tmp_path / "model"))
+
+        issues = ["Fix typo in README", "Add a button", " ".join(["word"] * 40)]
+        path = str(tmp_path / "model.tflite")
+        model.export_quantized(path, representative_issues=issues * 10)
+
+        inputs = model._collate([model._encode(issue) for issue in issues])
+        expected = np.asarray(model._infer(inputs))
+
+        model._interpreter = model._load_quantized(path)
+        model._interpreter_lock = threading.Lock()
+        np.testing.assert_allclose(model._forward_quantized(inputs), expected, atol=0.05)